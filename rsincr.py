@@ -6,69 +6,222 @@
 """Wrapper around rsync to perform filesystem-level differential backups using hardlinks."""
 
 import argparse
+import collections
+import concurrent.futures
+import datetime
+import functools
+import hashlib
+import importlib
 import logging
+import logging.handlers
 import sys
 import fcntl
 import atexit
 import os
-import time
 import subprocess
 import tempfile
-import toml
-from schema import Schema, SchemaError, Optional, Or
-import sysrsync
+import shutil
+import shlex
+
+# Run-scoped backup parameters, computed once in main() and shared by every backup job, so
+# that all jobs in one run (including parallel ones) land in the same dated directory
+BackupRun = collections.namedtuple('BackupRun', ['timestamp', 'backup_type'])
+
+# Config structure understood by validate_config/validate_section:
+# per-section {key: (type, required, element type for lists)}
+CONFIG_SPEC = {
+    'global': {'max_parallel_jobs': (int, False, None)},
+    'rsync': {'bwlimit': (str, False, None),
+              'additional_rsync_opts': (list, False, str),
+              'transfer_mode': (str, False, None)},
+    'destination': {'server': (str, False, None),
+                    'local': (bool, False, None)},
+    'schedule': {'full_backup_week_days': (list, False, int),
+                 'full_backup_month_days': (list, False, int),
+                 'retention_days': (int, False, None)},
+}
+# rsync options identical for every run, frozen once at import (saves rebuilding the
+# list and re-normalising the --link-dest path on each invocation)
+STATIC_RSYNC_OPTIONS = ('-a',
+                        '--delete',
+                        '--no-motd',
+                        '--link-dest=' + os.path.join('..', 'latest'))
+
+BACKUP_JOB_SPEC = {'source_dir': ((str, list), True, str),
+                   'dest_dir': (str, True, None),
+                   'compress': (bool, False, None),
+                   'exclude': (list, False, str),
+                   'skip_unchanged': (bool, False, None),
+                   'change_list_cmd': (str, False, None),
+                   'change_list_ref': (str, False, None)}
+
+def lazy_import(module_name):
+    """Import and return module_name, deferring the cost until first needed.
+
+    Heavy third-party modules are imported through here rather than at module scope, so
+    --help and argument-error paths do not pay their import cost.
+
+    Exit with a friendly error if the module is not installed
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        sys.exit(f'Required module \'{module_name}\' is not installed')
 
 def main():
     """Execute rsync using parsed arguments and config."""
 
     args = parse_args()
-    logging.info('Execution starting using config file %s', args.config_file.name)
-    config = toml.load(args.config_file)
-    logging.debug('Configuration dump: %s', config)
-    validate_config(config)
 
-    server = config['destination']['server']
+    # Take the lock before parsing config or doing any other work, so a contending
+    # invocation (e.g. cron overlap) exits as early and cheaply as possible
+    acquire_lock(args.lockfile)
+
+    logging.info('Execution starting using config file %s', args.config_file)
+    try:
+        config = load_config(args.config_file, os.stat(args.config_file).st_mtime_ns)
+    except OSError as exception:
+        logging.error('Could not read config file \'%s\'', args.config_file)
+        sys.exit(f'Could not read config file \'{args.config_file}\': {exception.strerror}')
+
+    # server is None for local destinations; the remote helpers fall back to direct
+    # filesystem operations and rsync runs without SSH
+    server = config['destination'].get('server')
+    now = datetime.datetime.now()
     if args.force_full_backup:
         logging.debug('Full backup forced by command line argument')
         print('Backup type: Full - forcing rsync to read full files on source and dest and '
               'compare checksums')
         backup_type = 'full'
     else:
-        backup_type = get_backup_type(config)
+        backup_type = get_backup_type(config, now)
+    backup_run = BackupRun(now.strftime('%Y%m%dT%H%M%S'), backup_type)
+
+    ssh_options = setup_connection_sharing(server) if server else []
+    base_rsync_options = build_base_rsync_options(config, backup_type, ssh_options,
+                                                  args.loglevel)
+
+    max_workers = args.jobs or config['global'].get('max_parallel_jobs', 4)
+    logging.debug('Running up to %s backup jobs in parallel', max_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_backup_job, ssh_options, base_rsync_options,
+                                   config, backup_job_name, backup_run)
+                   for backup_job_name in config['backup_jobs']]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+        if config['schedule'].get('retention_days', False):
+            run_purge_jobs(executor, server, ssh_options, config)
+
+def acquire_lock(lockfile):
+    """Take an exclusive lock on lockfile to ensure we have only one instance running.
 
-    lockfile = config['global'].get('lockfile', '.rsincr.lock')
+    Exit with EX_TEMPFAIL if another instance holds the lock
+    """
     logging.debug('Attempting to lock lockfile %s to ensure we have only one instance running',
                   lockfile)
-    lockfile_handle = open(lockfile, 'w')
+    # O_CLOEXEC keeps the lock fd out of the ssh/rsync children we spawn, so a lingering
+    # child cannot hold the lock after rsincr itself has exited
+    lockfile_fd = os.open(lockfile, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
     try:
-        fcntl.lockf(lockfile_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
-    except OSError as exception:
-        logging.error('Could not lock lockfile %s. Another instance may already be running.',
-                      lockfile)
-        raise exception
-    # Register a cleanup function to remove lockfile when we exit
-    atexit.register(remove_lockfile, lockfile)
-
-    for backup_job_name in config['backup_jobs']:
-        print(f'Starting backup job {backup_job_name}')
-        backup(server,
-               config['rsync'].get('bwlimit', False),
-               config['rsync'].get('additional_rsync_opts', False),
-               config['backup_jobs'][backup_job_name],
-               backup_type)
-        if config['schedule'].get('retention_days', False):
-            print(f'Purging backups older than {config["schedule"]["retention_days"]} days for '
-                  f'backup job {backup_job_name}')
-            purge(server,
-                  config['rsync'].get('additional_rsync_opts', False),
-                  config['backup_jobs'][backup_job_name],
-                  config['schedule']['retention_days'])
-
-def get_backup_type(config):
-    """Return the backup type that should be run ('incremental' or 'full')."""
-
-    if int(time.strftime('%w')) in config['schedule'].get('full_backup_week_days', []) or \
-            int(time.strftime('%d')) in config['schedule'].get('full_backup_month_days', []):
+        fcntl.lockf(lockfile_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        holder_pid = str(os.read(lockfile_fd, 32), 'utf-8').strip()
+        logging.error('Could not lock lockfile %s. Another instance (PID %s) may already be '
+                      'running.', lockfile, holder_pid or 'unknown')
+        sys.exit(os.EX_TEMPFAIL)
+    # Record our PID in the lockfile for operators; the lock itself is released by the
+    # kernel when we exit (however we exit), so the file never needs removing
+    os.ftruncate(lockfile_fd, 0)
+    os.write(lockfile_fd, f'{os.getpid()}\n'.encode())
+
+def build_base_rsync_options(config, backup_type, ssh_options, loglevel=None):
+    """Return the rsync options shared by every backup job.
+
+    Built once per run; backup() copies and extends these with per-job options.
+    """
+    # Per-file progress output is only worth its CPU and bandwidth when debugging
+    rsync_options = [*STATIC_RSYNC_OPTIONS]
+    if ssh_options:
+        rsync_options.extend(['-e', ' '.join(['ssh'] + ssh_options)])
+    if loglevel == 'DEBUG':
+        rsync_options.append('--progress')
+    if config['rsync'].get('transfer_mode', 'delta') == 'whole':
+        # Skip the delta algorithm and the temp-file+rename dance on the destination;
+        # cheaper for trees of small files over fast networks, at the cost of non-atomic
+        # in-place updates if a transfer is interrupted
+        rsync_options.extend(['-W', '--inplace'])
+    if config['rsync'].get('bwlimit', False):
+        rsync_options.append(f'--bwlimit={config["rsync"]["bwlimit"]}')
+    rsync_options.extend(config['rsync'].get('additional_rsync_opts') or [])
+    if backup_type == 'full':
+        rsync_options.append('--checksum')
+    return rsync_options
+
+def run_purge_jobs(executor, server, ssh_options, config):
+    """Purge expired backups for every destination directory, fanned out via executor.
+
+    Jobs may share a destination directory; each directory is purged exactly once.
+    """
+    retention_days = config['schedule']['retention_days']
+    print(f'Purging backups older than {retention_days} days')
+    purge_jobs = {backup_job['dest_dir']: backup_job
+                  for backup_job in config['backup_jobs'].values()}
+    purge_futures = [executor.submit(purge, server, ssh_options, backup_job, retention_days)
+                     for backup_job in purge_jobs.values()]
+    for future in concurrent.futures.as_completed(purge_futures):
+        future.result()
+
+def run_backup_job(ssh_options, base_rsync_options, config, backup_job_name, backup_run):
+    """Execute backup for a single backup job.
+
+    Backup jobs are independent of each other and network/IO-bound, so main() runs them
+    concurrently in a thread pool. Purging happens separately, once per destination
+    directory, after all backups complete.
+    """
+    server = config['destination'].get('server')
+    print(f'Starting backup job {backup_job_name}')
+    backup(server,
+           ssh_options,
+           base_rsync_options,
+           config['backup_jobs'][backup_job_name],
+           backup_run)
+
+def setup_connection_sharing(server):
+    """Start a persistent SSH master connection to server and enable connection sharing.
+
+    All subsequent SSH (and rsync-over-SSH) commands multiplex over the master connection,
+    avoiding a full TCP/key exchange/auth handshake per command.
+
+    Return the SSH options needed to share the master connection.
+    """
+    control_dir = tempfile.mkdtemp(prefix='rsincr.')
+    control_path = os.path.join(control_dir, 'control-%C')
+    # ControlMaster=auto (rather than yes) on every command means any later command can
+    # transparently re-establish the master connection if it dies mid-run
+    ssh_options = ['-o', 'ControlMaster=auto', '-o', 'ControlPersist=600',
+                   '-o', f'ControlPath={control_path}']
+    logging.info('Starting SSH master connection to server \'%s\'', server)
+    logging.debug('Executing \'ssh %s -Nf %s\'', ' '.join(ssh_options), server)
+    subprocess.run(['ssh', *ssh_options, '-Nf', server], check=True)
+    # Register a cleanup function to stop the master connection when we exit
+    atexit.register(teardown_connection_sharing, server, ssh_options, control_dir)
+    return ssh_options
+
+def teardown_connection_sharing(server, ssh_options, control_dir):
+    """Cleanup function to stop the SSH master connection and remove the control directory."""
+    logging.debug('Stopping SSH master connection to server \'%s\'', server)
+    subprocess.run(['ssh', *ssh_options, '-O', 'exit', server],
+                   check=False, capture_output=True)
+    shutil.rmtree(control_dir, ignore_errors=True)
+
+def get_backup_type(config, now):
+    """Return the backup type that should be run ('incremental' or 'full').
+
+    now is the run's single reference datetime, computed once in main()
+    """
+    if now.isoweekday() % 7 in config['schedule'].get('full_backup_week_days', []) or \
+            now.day in config['schedule'].get('full_backup_month_days', []):
         print('Backup type: Full - forcing rsync to read full files on source and dest and compare '
               'checksums')
         return 'full'
@@ -76,194 +229,420 @@ def get_backup_type(config):
     print('Backup type: Incremental')
     return 'incremental'
 
-def backup(server, bwlimit, additional_rsync_opts, backup_job, backup_type='incremental'):
+def backup(server, ssh_options, base_rsync_options, backup_job, backup_run):
     """Execute rsync for backup_job.
 
     Raises RsyncError if rsync exits non-zero
     """
-    datetime = time.strftime("%Y%m%dT%H%M%S")
-    logging.debug('Datetime: %s', datetime)
-    source_dir, dest_dir = backup_job['source_dir'], backup_job['dest_dir']
-    logging.debug('Source: %s', source_dir)
-    logging.debug('Destination: %s:%s', server, dest_dir)
-
-    remote_mkdir(server, dest_dir)
-
-    logging.info('Starting rsync of %s to %s:%s',
-                 source_dir, server, os.path.join(dest_dir, datetime))
-
-    rsync_options = ['-a',
-                     '--delete',
-                     '--link-dest=' + os.path.join('..', 'latest')]
-    if bwlimit:
-        rsync_options.append(f'--bwlimit={bwlimit}')
-    if additional_rsync_opts:
-        for rsync_opt in additional_rsync_opts:
-            rsync_options.append(rsync_opt)
-    if backup_type == 'full':
-        rsync_options.append('--checksum')
+    timestamp = backup_run.timestamp
+    logging.debug('Timestamp: %s', timestamp)
+    # source_dir may be a single directory or a list of directories backed up together
+    source_dirs, dest_dir = backup_job['source_dir'], backup_job['dest_dir']
+    if not isinstance(source_dirs, list):
+        source_dirs = [source_dirs]
+    logging.debug('Source(s): %s', source_dirs)
+    logging.debug('Destination: %s', f'{server}:{dest_dir}' if server else dest_dir)
+
+    statefile = source_mtime = None
+    if backup_job.get('skip_unchanged') and backup_run.backup_type != 'full':
+        statefile = mtime_statefile(server, backup_job)
+        source_mtime = max(get_source_mtime(os.path.expanduser(source_dir))
+                           for source_dir in source_dirs)
+        if source_mtime == read_recorded_mtime(statefile):
+            print(f'Source(s) {source_dirs} unchanged since the last backup; '
+                  'cloning latest snapshot instead of running rsync')
+            remote_clone(timestamp, server, ssh_options, dest_dir)
+            return
+
+    remote_mkdir(server, ssh_options, dest_dir)
+
+    use_change_list = bool(backup_job.get('change_list_cmd')) and \
+        backup_run.backup_type != 'full'
+    if use_change_list:
+        # A changed-files-only rsync must start from a complete hardlink copy of the
+        # previous backup, or every unlisted (unchanged) file would be missing from the
+        # new snapshot
+        if not remote_clone_latest(timestamp, server, ssh_options, dest_dir):
+            logging.warning('No \'latest\' backup to clone in \'%s\'; falling back to a '
+                            'full source-tree walk', dest_dir)
+            use_change_list = False
+
+    destination = os.path.join(dest_dir, timestamp)
+    if server:
+        destination = f'{server}:{destination}'
+    logging.info('Starting rsync of %s to %s', source_dirs, destination)
+
+    change_list_ref_time = None
+    if backup_job.get('change_list_ref'):
+        # Capture the reference instant before the change list is generated: anything
+        # modified while the backup runs stays newer than the ref, so the next change
+        # list still picks it up
+        change_list_ref_time = datetime.datetime.now().timestamp()
+
+    rsync_options, option_files = build_job_rsync_options(base_rsync_options, backup_job,
+                                                          use_change_list)
+    run_rsync(source_dirs, destination, rsync_options, option_files)
+
+    remote_finalize(timestamp, server, ssh_options, dest_dir)
+
+    if change_list_ref_time is not None:
+        # Promote the pre-backup reference time only now the backup has succeeded
+        touch_change_list_ref(backup_job['change_list_ref'], change_list_ref_time)
+
+    if statefile:
+        record_mtime(statefile, source_mtime)
+
+def run_rsync(source_dirs, destination, rsync_options, option_files):
+    """Invoke rsync for source_dirs into destination, removing temporary option files after.
+
+    Raises CalledProcessError if rsync exits non-zero
+    """
+    expanded_source_dirs = [os.path.expanduser(source_dir) for source_dir in source_dirs]
+    if len(expanded_source_dirs) == 1:
+        # A single source syncs its contents into the timestamped directory (trailing
+        # slash); multiple sources each become a subdirectory of it
+        expanded_source_dirs[0] = expanded_source_dirs[0].rstrip('/') + '/'
+    logging.debug('Executing \'rsync %s %s %s\'',
+                  ' '.join(rsync_options), ' '.join(expanded_source_dirs), destination)
+    try:
+        subprocess.run(['rsync', *rsync_options, *expanded_source_dirs, destination],
+                       check=True)
+    finally:
+        for option_file in option_files:
+            os.unlink(option_file.name)
+
+def build_job_rsync_options(base_rsync_options, backup_job, use_change_list):
+    """Return rsync options and temporary option files for a single backup job.
+
+    The caller must remove the returned temporary files once rsync has run
+    """
+    rsync_options = list(base_rsync_options)
+    option_files = []
     if backup_job.get('compress'):
         rsync_options.append('-z')
-    if backup_job.get('exclude'):
-        for exclusion in backup_job['exclude']:
-            rsync_options.append(f'--exclude={exclusion}')
-
-    logging.debug('Executing \'rsync %s %s %s:%s\'',
-                  ' '.join(rsync_options), os.path.expanduser(source_dir),
-                  server, os.path.join(dest_dir, datetime))
-    sysrsync.run(source=os.path.expanduser(source_dir),
-                 destination_ssh=server,
-                 destination=os.path.join(dest_dir, datetime),
-                 options=rsync_options)
-
-    logging.info('Updating mtime of %s:%s', server, os.path.join(dest_dir, datetime))
-    logging.debug('Executing \'ssh %s touch "%s"\'', server, os.path.join(dest_dir, datetime))
-    subprocess.run(["ssh", server, "touch", os.path.join(dest_dir, datetime)], check=True)
-
-    remote_link(datetime, server, dest_dir)
-
-def remote_mkdir(server, dest_dir):
-    """Create directory on server if it does not exist."""
-    logging.info('Checking if destination directory \'%s\' exists on server \'%s\'',
-                 dest_dir, server)
-    logging.debug('Executing \'ssh %s [[ -d "%s" ]]\'', server, dest_dir)
-    exists_check = subprocess.run(["ssh", server, "[[", "-d", dest_dir, "]]"], check=False,
-                                  capture_output=True)
-    if not exists_check.returncode == 0:
-        if exists_check.stdout or exists_check.stderr:
-            # Bash '[[ -d ]]' test should output nothing even if the directory does not exist.
-            # If we have output, something went wrong (e.g. we couldn't SSH to server).
-            logging.error(
-                'Unexpected output checking for existence of directory \'%s\' on server \'%s\'',
-                dest_dir, server)
-            logging.error('stdout: %s', str(exists_check.stdout, 'utf-8'))
-            logging.error('stderr: %s', str(exists_check.stderr, 'utf-8'))
-            raise Exception('Unexpected output checking for existence of remote directory')
-        logging.warning('Destination directory \'%s\' does not exist on server \'%s\'; Creating it',
-                        dest_dir, server)
-        logging.debug('Executing \'ssh %s mkdir -p "%s"\'', server, dest_dir)
-        subprocess.run(["ssh", server, "mkdir", "-p", dest_dir], check=True)
-
-def purge(server, additional_rsync_opts, backup_job, retention_days):
-    """Purge any backup subdirectories in server:dest_dir that are older than retention_days."""
-    dest_dir = backup_job['dest_dir']
+    if len(backup_job.get('exclude', [])) > 4:
+        # Pass large exclusion lists to rsync as a single --exclude-from file rather than
+        # one --exclude argument per pattern; argv size stays constant however long the
+        # exclusion list grows
+        with tempfile.NamedTemporaryFile(mode='w', prefix='rsincr.',
+                                         delete=False) as exclude_file:
+            exclude_file.write('\n'.join(backup_job['exclude']) + '\n')
+        rsync_options.append(f'--exclude-from={exclude_file.name}')
+        option_files.append(exclude_file)
+    else:
+        # Short lists skip the temporary file and go straight on the command line
+        rsync_options.extend(f'--exclude={exclusion}'
+                             for exclusion in backup_job.get('exclude', []))
+    if use_change_list:
+        # A pre-computed change list lets rsync skip its full source-tree walk. The new
+        # snapshot was already hardlink-cloned from 'latest', so only listed paths need
+        # examining; --link-dest still hardlinks any listed-but-unchanged files
+        change_list_file = write_change_list(backup_job['change_list_cmd'])
+        rsync_options.append(f'--files-from={change_list_file.name}')
+        option_files.append(change_list_file)
+    return rsync_options, option_files
+
+def write_change_list(change_list_cmd):
+    """Run change_list_cmd and write its output (one path per line, relative to the job's
+    source_dir) to a temporary file for rsync --files-from.
+
+    Return the temporary file object
+    """
+    logging.debug('Executing change_list_cmd \'%s\'', change_list_cmd)
+    change_list = subprocess.run(change_list_cmd, shell=True, capture_output=True, check=True)
+    with tempfile.NamedTemporaryFile(mode='wb', prefix='rsincr.',
+                                     delete=False) as change_list_file:
+        change_list_file.write(change_list.stdout)
+    return change_list_file
+
+def touch_change_list_ref(change_list_ref, reference_time):
+    """Set change_list_ref's mtime to reference_time, creating the file if needed.
+
+    reference_time is captured before the change list is generated, so files modified
+    while the backup ran remain newer than the ref and appear in the next change list
+    """
+    with open(change_list_ref, 'a', encoding='utf-8'):
+        pass
+    os.utime(change_list_ref, times=(reference_time, reference_time))
+
+def get_source_mtime(source_dir):
+    """Return the most recent modification time (in ns) of source_dir and everything under it."""
+    latest_mtime = os.lstat(source_dir).st_mtime_ns
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        for entry in dirnames + filenames:
+            entry_mtime = os.lstat(os.path.join(dirpath, entry)).st_mtime_ns
+            latest_mtime = max(latest_mtime, entry_mtime)
+    return latest_mtime
+
+def mtime_statefile(server, backup_job):
+    """Return the path of the file recording a backup job's last-seen source mtime.
+
+    The filename is a digest of the job's full identity (server, source and destination),
+    so jobs sharing a dest_dir, the same path on different servers, or destination paths
+    that would sanitise to the same filename all get distinct statefiles
+    """
+    cache_dir = os.path.expanduser(os.path.join('~', '.cache', 'rsincr'))
+    os.makedirs(cache_dir, exist_ok=True)
+    job_identity = repr((server, backup_job['source_dir'], backup_job['dest_dir']))
+    job_digest = hashlib.sha256(job_identity.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{job_digest}.lastmtime')
+
+def read_recorded_mtime(statefile):
+    """Return the source mtime recorded by the previous run, or None if none is recorded."""
+    try:
+        with open(statefile, encoding='utf-8') as statefile_handle:
+            return int(statefile_handle.read())
+    except (FileNotFoundError, ValueError):
+        return None
 
-    expired_backups = get_expired_backups(server, dest_dir, retention_days)
+def record_mtime(statefile, source_mtime):
+    """Record source_mtime in statefile for the next run's skip_unchanged check."""
+    with open(statefile, 'w', encoding='utf-8') as statefile_handle:
+        statefile_handle.write(f'{source_mtime}\n')
 
-    if not expired_backups:
-        logging.info('No expired backups found in destination directory %s on server %s',
-                     dest_dir, server)
-        return
+def remote_clone_latest(timestamp, server, ssh_options, dest_dir):
+    """Hardlink-clone the 'latest' backup directory to a new timestamped directory.
 
-    rsync_options = ['-r', '--delete']
-    if additional_rsync_opts:
-        for rsync_opt in additional_rsync_opts:
-            rsync_options.append(rsync_opt)
-
-    for expired_backup in expired_backups:
-        print(f'Purging expired backup {expired_backup} on server {server}')
-        with tempfile.TemporaryDirectory() as tmp_empty_dir:
-            logging.debug('Executing \'rsync %s %s %s:%s\'',
-                          ' '.join(rsync_options), tmp_empty_dir, server, expired_backup)
-            sysrsync.run(source=tmp_empty_dir,
-                         destination_ssh=server,
-                         destination=expired_backup,
-                         options=rsync_options)
-        logging.debug('Executing \'ssh %s rmdir "%s"\'', server, expired_backup)
-        subprocess.run(['ssh', server, 'rmdir', expired_backup], check=True)
-
-def get_expired_backups(server, dest_dir, retention_days):
-    """Return subdirectories of server:dest_dir that are (retention_days + 1) old, or older."""
-    logging.debug('Executing \'ssh %s find -H "%s" -mindepth +%s\'',
-                  server, dest_dir, retention_days)
-    find_process = subprocess.run(['ssh', server,
-                                   'find', '-H', dest_dir,
-                                   '-mindepth', '1', '-maxdepth', '1', '-type', 'd',
-                                   '-mtime', f'+{retention_days}'],
-                                  capture_output=True, check=True)
-
-    if find_process.stdout in [None, b'']:
-        return False
-
-    # find_process.stdout is a byte-string of line-separated directory names
-    # Return this as a list of utf8-converted strings
-    return list(map(lambda x: str(x, 'utf-8'), find_process.stdout.splitlines()))
-
-def remote_link(datetime, server, dest_dir):
-    """Symlink 'latest' to a datetime-stamped backup directory.
+    The clone (cp -al) transfers no file data. Return True if a clone was made, False if
+    there is no 'latest' to clone (first backup of a destination).
 
     Raises CalledProcessError on failure
     """
-    logging.info('Symlinking \'latest\' to \'%s\'', datetime)
-    logging.debug('Executing \'ssh %s ln -sfn %s %s\'',
-                  server, datetime, os.path.join(dest_dir, 'latest'))
-    subprocess.run(["ssh", server, "ln", "-sfn", datetime, os.path.join(dest_dir, 'latest')],
+    if server is None:
+        latest_path = os.path.join(dest_dir, 'latest')
+        if not os.path.islink(latest_path):
+            return False
+        logging.info('Cloning \'latest\' to \'%s\' in \'%s\'', timestamp, dest_dir)
+        subprocess.run(['cp', '-al', os.path.join(dest_dir, os.readlink(latest_path)),
+                        os.path.join(dest_dir, timestamp)], check=True)
+        return True
+    logging.info('Cloning \'latest\' to \'%s\' on server \'%s\'', timestamp, server)
+    script = (f'cd {shlex.quote(dest_dir)} && if [ -h latest ]; then '
+              f'cp -al "$(readlink latest)" {shlex.quote(timestamp)} && echo cloned; fi')
+    logging.debug('Executing \'ssh %s %s\'', server, script)
+    clone_process = subprocess.run(["ssh", *ssh_options, server, script],
+                                   capture_output=True, check=True)
+    return b'cloned' in clone_process.stdout
+
+def remote_clone(timestamp, server, ssh_options, dest_dir):
+    """Clone the 'latest' backup directory to a new timestamped directory and re-point
+    'latest' at it.
+
+    Used when the source is unchanged: the new backup directory is created entirely from
+    hardlinks, with zero file transfer.
+
+    Raises CalledProcessError on failure
+    """
+    remote_clone_latest(timestamp, server, ssh_options, dest_dir)
+    remote_finalize(timestamp, server, ssh_options, dest_dir)
+
+def remote_mkdir(server, ssh_options, dest_dir):
+    """Create directory on server if it does not exist.
+
+    mkdir -p is idempotent, so no existence pre-check is needed; legitimate failures
+    (permissions etc) surface through check=True.
+
+    Raises CalledProcessError on failure
+    """
+    if server is None:
+        logging.info('Ensuring local destination directory \'%s\' exists', dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+        return
+    logging.info('Ensuring destination directory \'%s\' exists on server \'%s\'',
+                 dest_dir, server)
+    # Quote arguments parsed by the remote shell; dest_dir comes from user config and may
+    # contain whitespace or metacharacters
+    logging.debug('Executing \'ssh %s mkdir -p %s\'', server, shlex.quote(dest_dir))
+    subprocess.run(["ssh", *ssh_options, server, "mkdir", "-p", shlex.quote(dest_dir)],
                    check=True)
 
-def parse_args(argv=None):
-    """Create arguments and populate variables from args.
+def purge(server, ssh_options, backup_job, retention_days):
+    """Purge any backup subdirectories in server:dest_dir that are older than retention_days.
 
-    Return args namespace
+    Expired backups are found and deleted by a single remote find invocation, avoiding an
+    SSH round trip and an rsync run per expired backup.
+    """
+    dest_dir = backup_job['dest_dir']
+
+    find_command = ['find', '-H', shlex.quote(dest_dir) if server else dest_dir,
+                    '-mindepth', '1', '-maxdepth', '1', '-type', 'd',
+                    '-mtime', f'+{retention_days}',
+                    '-print0', '-exec', 'rm', '-rf', '{}', '+']
+    purge_command = ['ssh', *ssh_options, server, *find_command] if server else find_command
+    logging.debug('Executing \'%s\'', ' '.join(purge_command))
+    purged_backups = 0
+    # Stream find's stdout rather than buffering it, so memory use does not grow with the
+    # number of expired backups. Directory names are NUL-delimited (-print0) so names
+    # containing newlines are parsed correctly
+    with subprocess.Popen(purge_command, stdout=subprocess.PIPE) as purge_process:
+        remainder = b''
+        for chunk in iter(lambda: purge_process.stdout.read(8192), b''):
+            *expired_backups_chunk, remainder = (remainder + chunk).split(b'\0')
+            for expired_backup in expired_backups_chunk:
+                purged_backups += 1
+                print(f'Purged expired backup {str(expired_backup, "utf-8")}'
+                      + (f' on server {server}' if server else ''))
+
+    if purge_process.returncode != 0:
+        raise subprocess.CalledProcessError(purge_process.returncode, purge_process.args)
+
+    if not purged_backups:
+        logging.info('No expired backups found in destination directory %s', dest_dir)
+
+def remote_finalize(timestamp, server, ssh_options, dest_dir):
+    """Update mtime of a timestamped backup directory and symlink 'latest' to it.
+
+    Both operations are batched into a single SSH invocation to save a round trip.
+
+    Raises CalledProcessError on failure
     """
+    if server is None:
+        logging.info('Updating mtime of %s and symlinking \'latest\' to \'%s\'',
+                     os.path.join(dest_dir, timestamp), timestamp)
+        os.utime(os.path.join(dest_dir, timestamp))
+        # Equivalent of 'ln -sfn', but atomic: build the new symlink alongside and
+        # rename it over the old one
+        temporary_link = os.path.join(dest_dir, f'.latest.{os.getpid()}')
+        os.symlink(timestamp, temporary_link)
+        os.replace(temporary_link, os.path.join(dest_dir, 'latest'))
+        return
+    logging.info('Updating mtime of %s:%s and symlinking \'latest\' to \'%s\'',
+                 server, os.path.join(dest_dir, timestamp), timestamp)
+    script = ' && '.join([f'touch {shlex.quote(os.path.join(dest_dir, timestamp))}',
+                          f'ln -sfn {shlex.quote(timestamp)} '
+                          f'{shlex.quote(os.path.join(dest_dir, "latest"))}'])
+    logging.debug('Executing \'ssh %s %s\'', server, script)
+    subprocess.run(["ssh", *ssh_options, server, script], check=True)
+
+@functools.lru_cache(maxsize=1)
+def build_parser():
+    """Build the argument parser once; parse_args() reuses it on repeated calls."""
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-l', '--loglevel', type=str,
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='Logging/output verbosity')
-    parser.add_argument('-c', '--config-file', type=argparse.FileType('r'), default='rsincr.toml',
+    parser.add_argument('-c', '--config-file', type=str, default='rsincr.toml',
                         help='Config file (default: rsincr.toml)')
     parser.add_argument('-f', '--force-full-backup', type=bool, default=False,
                         help='Force a \'full\' backup (compare checksums of files on both sides), '\
                              'regardless of schedule')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Maximum number of backup jobs to run in parallel '
+                             '(overrides config key max_parallel_jobs)')
+    parser.add_argument('-k', '--lockfile', type=str, default='.rsincr.lock',
+                        help='Lockfile used to ensure only one instance is running '
+                             '(default: .rsincr.lock)')
+
+    return parser
 
-    args = parser.parse_args(argv)
+def parse_args(argv=None):
+    """Create arguments and populate variables from args.
+
+    Return args namespace
+    """
+    args = build_parser().parse_args(argv)
 
     if args.loglevel:
         logging.basicConfig(level=args.loglevel)
+        buffer_logging()
 
     return args
 
+def buffer_logging():
+    """Route log records through an in-memory buffer, flushed on WARNING or at exit.
+
+    With parallel jobs every log line is otherwise a handler-lock acquisition and a write
+    syscall; buffering batches the writes while warnings and errors still emit immediately
+    """
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        root_logger.addHandler(logging.handlers.MemoryHandler(
+            100, flushLevel=logging.WARNING, target=handler))
+
+@functools.lru_cache(maxsize=4)
+def load_config(config_path, config_mtime):
+    """Parse and validate config file.
+
+    Results are cached on (config_path, config_mtime), so repeated invocations skip
+    re-parsing and re-validating an unchanged config file.
+    """
+    logging.debug('Parsing config file %s (mtime %s)', config_path, config_mtime)
+    config = parse_config_file(config_path)
+    logging.debug('Configuration dump: %s', config)
+    validate_config(config)
+    return config
+
+def parse_config_file(config_path):
+    """Parse a TOML config file.
+
+    Uses the C-backed stdlib tomllib on Python 3.11+, falling back to the pure-Python
+    toml package on older interpreters
+    """
+    try:
+        tomllib = importlib.import_module('tomllib')
+    except ImportError:  # Python < 3.11
+        return lazy_import('toml').load(config_path)
+    with open(config_path, 'rb') as config_file:
+        return tomllib.load(config_file)
+
+def validate_section(section_name, section, section_spec):
+    """Validate one config section against section_spec.
+
+    Raise ValueError describing the first mismatch found
+    """
+    if not isinstance(section, dict):
+        raise ValueError(f"Key '{section_name}' error:\nNot a section")
+    for key, value in section.items():
+        if key not in section_spec:
+            raise ValueError(f"Key '{section_name}' error:\nWrong key: '{key}'")
+        expected_type, _, element_type = section_spec[key]
+        if not isinstance(value, expected_type):
+            type_names = ' or '.join(
+                expected.__name__ for expected in
+                (expected_type if isinstance(expected_type, tuple) else (expected_type,)))
+            raise ValueError(f"Key '{section_name}' error:\nKey '{key}' error:\n"
+                             f"{value!r} should be instance of '{type_names}'")
+        if element_type and isinstance(value, list) and \
+                not all(isinstance(element, element_type) for element in value):
+            raise ValueError(f"Key '{section_name}' error:\nKey '{key}' error:\n"
+                             f"All elements of {value!r} should be instance of "
+                             f"'{element_type.__name__}'")
+    for key, (_, required, _) in section_spec.items():
+        if required and key not in section:
+            raise ValueError(f"Key '{section_name}' error:\nMissing key: '{key}'")
+
 def validate_config(config):
-    """Validate config against schema.
+    """Validate config structure and types.
 
     Raise exception if config does not validate
     """
-    config_schema = Schema({
-        'global': {
-            Optional('lockfile'): str
-        },
-        'rsync': {
-            Optional('bwlimit'): str,
-            Optional('additional_rsync_opts'): Or([str], [])
-        },
-        'destination': {
-            'server': str
-        },
-        'schedule': {
-            Optional('full_backup_week_days'): Or([int], []),
-            Optional('full_backup_month_days'): Or([int], []),
-            Optional('retention_days'): int
-        },
-        'backup_jobs': {
-            str: {
-                'source_dir': str,
-                'dest_dir': str,
-                Optional('compress'): bool,
-                Optional('exclude'): Or([str], [])
-            }
-        }
-    })
-
     try:
-        config_schema.validate(config)
-    except SchemaError as exception:
+        for section_name in list(CONFIG_SPEC) + ['backup_jobs']:
+            if section_name not in config:
+                raise ValueError(f"Missing key: '{section_name}'")
+        for section_name in config:
+            if section_name not in CONFIG_SPEC and section_name != 'backup_jobs':
+                raise ValueError(f"Wrong key: '{section_name}'")
+        for section_name, section_spec in CONFIG_SPEC.items():
+            validate_section(section_name, config[section_name], section_spec)
+        if not isinstance(config['backup_jobs'], dict) or not config['backup_jobs']:
+            raise ValueError("Key 'backup_jobs' error:\nAt least one backup job must be defined")
+        for backup_job_name, backup_job in config['backup_jobs'].items():
+            validate_section(f'backup_jobs.{backup_job_name}', backup_job, BACKUP_JOB_SPEC)
+        if config['rsync'].get('transfer_mode', 'delta') not in ('delta', 'whole'):
+            raise ValueError("Key 'rsync' error:\nKey 'transfer_mode' error:\n"
+                             "Must be 'delta' or 'whole'")
+        if config['destination'].get('local'):
+            if 'server' in config['destination']:
+                raise ValueError("Key 'destination' error:\n"
+                                 "Only one of 'server' and 'local' may be set")
+        elif 'server' not in config['destination']:
+            raise ValueError("Key 'destination' error:\nMissing key: 'server'")
+    except ValueError as exception:
         logging.error('Could not validate config')
-        sys.exit(exception.code)
-
-def remove_lockfile(lockfile):
-    """Cleanup function to remove lockfile when we exit."""
-    logging.debug('Cleaning up (removing) lockfile %s', lockfile)
-    os.remove(lockfile)
+        sys.exit(str(exception))
 
 if __name__ == '__main__':
     main()
@@ -6,15 +6,16 @@
 """Tests for rsincr."""
 
 import os
-import time
 import copy
-from unittest import mock
+import datetime
+import logging
+import logging.handlers
 from argparse import Namespace
 import pytest
-from freezegun import freeze_time
+import time_machine
 import rsincr
 
-TEST_CONFIG = {'global': {'lockfile': 'lockfile01'},
+TEST_CONFIG = {'global': {'max_parallel_jobs': 2},
                'rsync': {'bwlimit': '1.5m',
                          'additional_rsync_opts': ['--acls']},
                'destination': {'server': 'server01'},
@@ -26,221 +27,678 @@ TEST_CONFIG = {'global': {'lockfile': 'lockfile01'},
                                          'compress': True,
                                          'exclude': ['exclusion01']}}}
 
+# The expected timestamp under the module-wide frozen clock; a constant saves a
+# time.strftime call (and its clock interception) in every time-sensitive test
+FROZEN_TIMESTAMP = '20190101T000000'
+
 SERVER = TEST_CONFIG['destination']['server']
-BWLIMIT = TEST_CONFIG['rsync']['bwlimit']
-ADDITIONAL_RSYNC_OPTS = TEST_CONFIG['rsync']['additional_rsync_opts']
+SSH_OPTIONS = ['-o', 'ControlPath=controlpath01']
+BASE_RSYNC_OPTIONS_INCREMENTAL = ['-a',
+                                  '--delete',
+                                  '--no-motd',
+                                  '--link-dest=../latest',
+                                  '-e', ' '.join(['ssh'] + SSH_OPTIONS),
+                                  f'--bwlimit={TEST_CONFIG["rsync"]["bwlimit"]}',
+                                  *TEST_CONFIG['rsync']['additional_rsync_opts']]
+BASE_RSYNC_OPTIONS_FULL = BASE_RSYNC_OPTIONS_INCREMENTAL + ['--checksum']
 RETENTION_DAYS = TEST_CONFIG['schedule']['retention_days']
 BACKUP_JOB = TEST_CONFIG['backup_jobs']['job01']
 DEST_DIR = BACKUP_JOB['dest_dir']
 SOURCE_DIR = BACKUP_JOB['source_dir']
 
-# Mock time to 2019-01-01 00:00:00 UTC (Tuesday)
-@freeze_time('2019-01-01')
-def test_main():
+# Backup job variants, built once at import rather than per test invocation
+SKIP_UNCHANGED_BACKUP_JOB = dict(BACKUP_JOB, skip_unchanged=True)
+MULTIPLE_SOURCES_BACKUP_JOB = {'source_dir': ['source01', 'source02'], 'dest_dir': DEST_DIR}
+LARGE_EXCLUDE_BACKUP_JOB = {'source_dir': SOURCE_DIR, 'dest_dir': DEST_DIR,
+                            'exclude': [f'exclusion{number:02}' for number in range(1, 6)]}
+
+# Mock time to 2019-01-01 00:00:00 UTC (Tuesday) for the whole module; entering the
+# traveller once amortises its setup across every test instead of per decorated test
+@pytest.fixture(scope='module', autouse=True)
+def frozen_time():
+    """Freeze time to 2019-01-01 for all tests in this module."""
+    with time_machine.travel('2019-01-01', tick=False):
+        yield
+
+def test_main(mocker):
     """Assert main() calls backup() with expected arguments, given command line args and config."""
-    with mock.patch('rsincr.parse_args') as mocked_parse_args, \
-         mock.patch('rsincr.toml.load') as mocked_toml_load, \
-         mock.patch('builtins.open'), \
-         mock.patch('rsincr.fcntl.lockf') as mocked_fcntl_lockf, \
-         pytest.raises(OSError) as pytest_wrapped_e_oserror, \
-         mock.patch('rsincr.atexit.register'), \
-         mock.patch('rsincr.backup') as mocked_backup, \
-         mock.patch('rsincr.purge') as mocked_purge:
-
-        mocked_parse_args.return_value = Namespace(
-            config_file=mock.Mock(name='test_config_file'), force_full_backup=False, loglevel=None)
-        mocked_toml_load.return_value = TEST_CONFIG
-        rsincr.main()
-        mocked_backup.assert_called_with(
-            SERVER, BWLIMIT, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, 'incremental')
-        mocked_purge.assert_called_with(SERVER, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, RETENTION_DAYS)
-
-        mocked_parse_args.return_value = Namespace(
-            config_file=mock.Mock(name='test_config_file'), force_full_backup=True, loglevel=None)
+    mocked_parse_args = mocker.patch('rsincr.parse_args')
+    mocked_parse_config_file = mocker.patch('rsincr.parse_config_file')
+    mocked_os_stat = mocker.patch('rsincr.os.stat')
+    mocked_acquire_lock = mocker.patch('rsincr.acquire_lock')
+    mocked_setup_connection_sharing = mocker.patch('rsincr.setup_connection_sharing')
+    mocked_backup = mocker.patch('rsincr.backup')
+    mocked_purge = mocker.patch('rsincr.purge')
+
+    mocked_setup_connection_sharing.return_value = SSH_OPTIONS
+
+    mocked_parse_args.return_value = Namespace(
+        config_file='config01.toml', force_full_backup=False,
+        loglevel=None, jobs=None, lockfile='lockfile01')
+    mocked_parse_config_file.return_value = TEST_CONFIG
+    rsincr.main()
+    mocked_acquire_lock.assert_called_with('lockfile01')
+    mocked_backup.assert_called_with(
+        SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL, BACKUP_JOB,
+        rsincr.BackupRun(FROZEN_TIMESTAMP, 'incremental'))
+    mocked_purge.assert_called_with(SERVER, SSH_OPTIONS, BACKUP_JOB, RETENTION_DAYS)
+
+    mocked_parse_args.return_value = Namespace(
+        config_file='config02.toml', force_full_backup=True,
+        loglevel=None, jobs=None, lockfile='lockfile01')
+    rsincr.main()
+    mocked_backup.assert_called_with(
+        SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_FULL, BACKUP_JOB,
+        rsincr.BackupRun(FROZEN_TIMESTAMP, 'full'))
+
+    mocked_parse_config_file.return_value = LOCAL_CONFIG
+    mocked_parse_args.return_value = Namespace(
+        config_file='config03.toml', force_full_backup=False,
+        loglevel=None, jobs=None, lockfile='lockfile01')
+    mocked_setup_connection_sharing.reset_mock()
+    rsincr.main()
+    mocked_setup_connection_sharing.assert_not_called()
+    mocked_backup.assert_called_with(
+        None, [], rsincr.build_base_rsync_options(LOCAL_CONFIG, 'incremental', []),
+        LOCAL_CONFIG['backup_jobs']['job01'],
+        rsincr.BackupRun(FROZEN_TIMESTAMP, 'incremental'))
+
+    mocked_os_stat.side_effect = OSError(2, 'No such file or directory')
+    with pytest.raises(SystemExit) as pytest_wrapped_e_bad_config:
         rsincr.main()
-        mocked_backup.assert_called_with(
-            SERVER, BWLIMIT, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, 'full')
+    assert pytest_wrapped_e_bad_config.value.code == \
+        "Could not read config file 'config03.toml': No such file or directory"
+    mocked_os_stat.side_effect = None
 
-        mocked_fcntl_lockf.side_effect = OSError
+    mocked_acquire_lock.side_effect = SystemExit(os.EX_TEMPFAIL)
+    with pytest.raises(SystemExit) as pytest_wrapped_e_lock_contention:
         rsincr.main()
-        assert pytest_wrapped_e_oserror.type == OSError
-
-# Mock time to 2019-01-01 00:00:00 UTC (Tuesday)
-@freeze_time('2019-01-01')
-def test_get_backup_type():
-    """Assert get_backup_type() returns correct backup type when called with config combinations."""
-    assert rsincr.get_backup_type({'schedule': {}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': []}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_month_days': []}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [1]}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [2]}}) == 'full'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_month_days': [1]}}) == 'full'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_month_days': [2]}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [1],
-                                                'full_backup_month_days': [2]}}) == 'incremental'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [2],
-                                                'full_backup_month_days': [1]}}) == 'full'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [1],
-                                                'full_backup_month_days': [1]}}) == 'full'
-    assert rsincr.get_backup_type({'schedule': {'full_backup_week_days': [2],
-                                                'full_backup_month_days': [2]}}) == 'full'
-
-# Mock time to 2019-01-01 00:00:00 UTC (Tuesday)
-@freeze_time('2019-01-01')
-def test_backup():
-    """Assert backup() calls sysrsync.run and remote_link with expected options."""
-    datetime = time.strftime("%Y%m%dT%H%M%S")
-    with mock.patch('rsincr.sysrsync.run') as mocked_sysrsync_run, \
-         mock.patch('rsincr.remote_mkdir') as mocked_remote_mkdir, \
-         mock.patch('rsincr.subprocess.run') as mocked_subprocess_run, \
-         mock.patch('rsincr.remote_link') as mocked_remote_link:
-
-        rsincr.backup(SERVER, BWLIMIT, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, 'full')
-
-    mocked_sysrsync_run.assert_called_with(
-        source=SOURCE_DIR, destination_ssh=SERVER, destination=os.path.join(DEST_DIR, datetime),
-        options=['-a',
-                 '--delete',
-                 '--link-dest=' + os.path.join('..', 'latest'),
-                 f'--bwlimit={BWLIMIT}',
-                 *ADDITIONAL_RSYNC_OPTS,
-                 '--checksum',
-                 '-z',
-                 f'--exclude={next(iter(BACKUP_JOB["exclude"]))}'])
-
-    mocked_remote_mkdir.assert_called_with(SERVER, DEST_DIR)
+    assert pytest_wrapped_e_lock_contention.value.code == os.EX_TEMPFAIL
+
+def test_acquire_lock(mocker):
+    """Assert acquire_lock() locks and records our PID, and exits EX_TEMPFAIL on contention."""
+    mocked_os_open = mocker.patch('rsincr.os.open')
+    mocked_fcntl_lockf = mocker.patch('rsincr.fcntl.lockf')
+    mocked_os_read = mocker.patch('rsincr.os.read')
+    mocked_os_ftruncate = mocker.patch('rsincr.os.ftruncate')
+    mocked_os_write = mocker.patch('rsincr.os.write')
+
+    mocked_os_open.return_value = 3
+    rsincr.acquire_lock('lockfile01')
+    mocked_os_open.assert_called_with(
+        'lockfile01', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    mocked_fcntl_lockf.assert_called_with(3, rsincr.fcntl.LOCK_EX | rsincr.fcntl.LOCK_NB)
+    mocked_os_ftruncate.assert_called_with(3, 0)
+    mocked_os_write.assert_called_with(3, f'{os.getpid()}\n'.encode())
+
+    mocked_os_read.return_value = b'12345\n'
+    mocked_fcntl_lockf.side_effect = OSError
+    with pytest.raises(SystemExit) as pytest_wrapped_e_lock_contention:
+        rsincr.acquire_lock('lockfile01')
+    assert pytest_wrapped_e_lock_contention.value.code == os.EX_TEMPFAIL
+
+@pytest.mark.parametrize('schedule,expected_backup_type', [
+    ({}, 'incremental'),
+    ({'full_backup_week_days': []}, 'incremental'),
+    ({'full_backup_month_days': []}, 'incremental'),
+    ({'full_backup_week_days': [1]}, 'incremental'),
+    ({'full_backup_week_days': [2]}, 'full'),
+    ({'full_backup_month_days': [1]}, 'full'),
+    ({'full_backup_month_days': [2]}, 'incremental'),
+    ({'full_backup_week_days': [1], 'full_backup_month_days': [2]}, 'incremental'),
+    ({'full_backup_week_days': [2], 'full_backup_month_days': [1]}, 'full'),
+    ({'full_backup_week_days': [1], 'full_backup_month_days': [1]}, 'full'),
+    ({'full_backup_week_days': [2], 'full_backup_month_days': [2]}, 'full'),
+])
+def test_get_backup_type(schedule, expected_backup_type):
+    """Assert get_backup_type() returns correct backup type for each schedule combination."""
+    # Reference datetime 2019-01-01 00:00:00 (Tuesday)
+    now = datetime.datetime(2019, 1, 1)
+    assert rsincr.get_backup_type({'schedule': schedule}, now) == expected_backup_type
+
+def test_backup(mocker):
+    """Assert backup() invokes rsync and remote_finalize with expected options."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_remote_mkdir = mocker.patch('rsincr.remote_mkdir')
+    mocked_remote_finalize = mocker.patch('rsincr.remote_finalize')
+
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_FULL, BACKUP_JOB,
+                  rsincr.BackupRun(timestamp, 'full'))
 
     mocked_subprocess_run.assert_called_with(
-        ['ssh', SERVER, 'touch', os.path.join(DEST_DIR, datetime)], check=True)
-
-    mocked_remote_link.assert_called_with(datetime, SERVER, DEST_DIR)
-
-def test_remote_mkdir():
-    """Assert remote_mkdir() calls subprocess.run for checks and directory creation."""
-    with mock.patch('rsincr.subprocess.run') as mocked_subprocess_run:
-
-        # If directory check succeeds, subprocess.run should only be called once
-        mocked_subprocess_run.return_value.returncode = 0
-        rsincr.remote_mkdir(SERVER, DEST_DIR)
-        mocked_subprocess_run.assert_called_once_with(
-            ['ssh', SERVER, '[[', '-d', DEST_DIR, ']]'], check=False, capture_output=True)
-
-        # If directory check errors out, subprocess.run should be called but followed by an
-        # exception
-        mocked_subprocess_run.return_value.returncode = 1
-        mocked_subprocess_run.return_value.stdout = b'Test stdout'
-        mocked_subprocess_run.return_value.stderr = b'Test stderr'
-        with pytest.raises(Exception) as pytest_wrapped_e_dirtest_stdout:
-            rsincr.remote_mkdir(SERVER, DEST_DIR)
-        mocked_subprocess_run.assert_called_with(
-            ['ssh', SERVER, '[[', '-d', DEST_DIR, ']]'], check=False, capture_output=True)
-        assert pytest_wrapped_e_dirtest_stdout.type == Exception
-
-        # If directory check reports directory does not exist, subprocess.run will be called a
-        # second time to mkdir
-        mocked_subprocess_run.return_value.returncode = [1, 0]
-        mocked_subprocess_run.return_value.stdout = ''
-        mocked_subprocess_run.return_value.stderr = ''
-        rsincr.remote_mkdir(SERVER, DEST_DIR)
-        mocked_subprocess_run.assert_called_with(['ssh', SERVER, 'mkdir', '-p', DEST_DIR],
-                                                 check=True)
-
-def test_purge():
-    """Assert purge() calls subprocess.run, sysrsync.run, get_expired_backups as expected."""
-    with mock.patch('rsincr.get_expired_backups') as mocked_get_expired_backups, \
-         mock.patch('rsincr.tempfile.TemporaryDirectory') as mocked_tempfile_temporarydirectory, \
-         mock.patch('rsincr.sysrsync.run') as mocked_sysrsync_run, \
-         mock.patch('rsincr.subprocess.run') as mocked_subprocess_run:
-
-        mocked_get_expired_backups.return_value = False
-        rsincr.purge(SERVER, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, RETENTION_DAYS)
-        mocked_get_expired_backups.assert_called_with(SERVER, DEST_DIR, RETENTION_DAYS)
-        mocked_tempfile_temporarydirectory.assert_not_called()
-        mocked_sysrsync_run.assert_not_called()
-        mocked_subprocess_run.assert_not_called()
-
-        mocked_get_expired_backups.return_value = ['exp_dir01']
-        mocked_tempfile_temporarydirectory.return_value.__enter__.return_value = 'empty_dir01'
-        rsincr.purge(SERVER, ADDITIONAL_RSYNC_OPTS, BACKUP_JOB, RETENTION_DAYS)
-        mocked_get_expired_backups.assert_called_with(SERVER, DEST_DIR, RETENTION_DAYS)
-        mocked_sysrsync_run.assert_called_with(source='empty_dir01',
-                                               destination_ssh=SERVER,
-                                               destination='exp_dir01',
-                                               options=['-r', '--delete', *ADDITIONAL_RSYNC_OPTS])
-        mocked_subprocess_run.assert_called_with(['ssh', SERVER, 'rmdir', 'exp_dir01'], check=True)
-
-def test_get_expired_backups():
-    """Assert purge() calls subprocess.run as expected and returns correct list."""
-    with mock.patch('rsincr.subprocess.run') as mocked_subprocess_run:
-
-        mocked_subprocess_run.return_value.stdout = b''
-        expired_backups = rsincr.get_expired_backups(SERVER, DEST_DIR, RETENTION_DAYS)
-        mocked_subprocess_run.assert_called_with(['ssh', SERVER, 'find', '-H', DEST_DIR,
-                                                  '-mindepth', '1', '-maxdepth', '1', '-type', 'd',
-                                                  '-mtime', f'+{RETENTION_DAYS}'],
-                                                 capture_output=True, check=True)
-        assert not expired_backups
-
-        mocked_subprocess_run.return_value.stdout = b'exp_dir01\nexp_dir02'
-        expired_backups = rsincr.get_expired_backups(SERVER, DEST_DIR, RETENTION_DAYS)
-        assert expired_backups == ['exp_dir01', 'exp_dir02']
-
-# Mock time to 2019-01-01 00:00:00 UTC (Tuesday)
-@freeze_time('2019-01-01')
-def test_remote_link():
-    """Assert remote_link() calls subprocess.run with expected options."""
-    datetime = time.strftime("%Y%m%dT%H%M%S")
-    with mock.patch('rsincr.subprocess.run') as mocked_subprocess_run:
-        rsincr.remote_link(datetime, SERVER, DEST_DIR)
-
+        ['rsync', *BASE_RSYNC_OPTIONS_FULL, '-z',
+         f'--exclude={next(iter(BACKUP_JOB["exclude"]))}',
+         SOURCE_DIR + '/', f'{SERVER}:{DEST_DIR}/{timestamp}'],
+        check=True)
+
+    mocked_remote_mkdir.assert_called_with(SERVER, SSH_OPTIONS, DEST_DIR)
+
+    mocked_remote_finalize.assert_called_with(timestamp, SERVER, SSH_OPTIONS, DEST_DIR)
+
+def test_backup_large_exclude_list(mocker):
+    """Assert backup() passes large exclusion lists via a single --exclude-from file."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_named_temporary_file = mocker.patch('rsincr.tempfile.NamedTemporaryFile')
+    mocked_os_unlink = mocker.patch('rsincr.os.unlink')
+    mocker.patch('rsincr.remote_mkdir')
+    mocker.patch('rsincr.remote_finalize')
+
+    mocked_exclude_file = mocked_named_temporary_file.return_value.__enter__.return_value
+    mocked_exclude_file.name = 'excludefile01'
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL,
+                  LARGE_EXCLUDE_BACKUP_JOB, rsincr.BackupRun(timestamp, 'incremental'))
+
+    mocked_exclude_file.write.assert_called_with(
+        '\n'.join(LARGE_EXCLUDE_BACKUP_JOB['exclude']) + '\n')
     mocked_subprocess_run.assert_called_with(
-        ['ssh', SERVER, 'ln', '-sfn', datetime, os.path.join(DEST_DIR, 'latest')], check=True)
+        ['rsync', *BASE_RSYNC_OPTIONS_INCREMENTAL, '--exclude-from=excludefile01',
+         SOURCE_DIR + '/', f'{SERVER}:{DEST_DIR}/{timestamp}'],
+        check=True)
+    mocked_os_unlink.assert_called_with('excludefile01')
+
+def test_backup_multiple_sources(mocker):
+    """Assert backup() transfers a list of source dirs with a single direct rsync invocation."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocker.patch('rsincr.remote_mkdir')
+    mocker.patch('rsincr.remote_finalize')
+
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL,
+                  MULTIPLE_SOURCES_BACKUP_JOB, rsincr.BackupRun(timestamp, 'incremental'))
+
+    mocked_subprocess_run.assert_called_once_with(
+        ['rsync', *BASE_RSYNC_OPTIONS_INCREMENTAL, 'source01', 'source02',
+         f'{SERVER}:{DEST_DIR}/{timestamp}'],
+        check=True)
+
+def test_backup_change_list(tmp_path, mocker):
+    """Assert backup() clones 'latest' before a changed-files-only rsync and touches the
+    ref file."""
+    timestamp = FROZEN_TIMESTAMP
+    change_list_ref = tmp_path / 'ref01'
+    backup_job = {'source_dir': SOURCE_DIR, 'dest_dir': DEST_DIR,
+                  'change_list_cmd': 'changelistcmd01',
+                  'change_list_ref': str(change_list_ref)}
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_write_change_list = mocker.patch('rsincr.write_change_list')
+    mocked_os_unlink = mocker.patch('rsincr.os.unlink')
+    mocked_remote_clone_latest = mocker.patch('rsincr.remote_clone_latest')
+    mocker.patch('rsincr.remote_mkdir')
+    mocker.patch('rsincr.remote_finalize')
+
+    mocked_remote_clone_latest.return_value = True
+    mocked_write_change_list.return_value.name = 'changelistfile01'
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL, backup_job,
+                  rsincr.BackupRun(timestamp, 'incremental'))
+
+    mocked_remote_clone_latest.assert_called_once_with(timestamp, SERVER, SSH_OPTIONS,
+                                                       DEST_DIR)
+    mocked_write_change_list.assert_called_once_with('changelistcmd01')
+    mocked_subprocess_run.assert_called_with(
+        ['rsync', *BASE_RSYNC_OPTIONS_INCREMENTAL, '--files-from=changelistfile01',
+         SOURCE_DIR + '/', f'{SERVER}:{DEST_DIR}/{timestamp}'],
+        check=True)
+    mocked_os_unlink.assert_called_with('changelistfile01')
+    assert change_list_ref.exists()
+    # The ref records the instant *before* the change list was generated (the frozen
+    # clock here), not the post-rsync time, so mid-backup changes are caught next run
+    assert change_list_ref.stat().st_mtime == datetime.datetime(2019, 1, 1).timestamp()
+
+def test_backup_change_list_without_latest(mocker):
+    """Assert backup() falls back to a full-walk rsync when there is no 'latest' to clone."""
+    backup_job = {'source_dir': SOURCE_DIR, 'dest_dir': DEST_DIR,
+                  'change_list_cmd': 'changelistcmd01'}
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_write_change_list = mocker.patch('rsincr.write_change_list')
+    mocked_remote_clone_latest = mocker.patch('rsincr.remote_clone_latest')
+    mocker.patch('rsincr.remote_mkdir')
+    mocker.patch('rsincr.remote_finalize')
+
+    mocked_remote_clone_latest.return_value = False
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL, backup_job,
+                  rsincr.BackupRun(FROZEN_TIMESTAMP, 'incremental'))
+
+    # A changed-files-only rsync against an empty directory would produce a partial
+    # snapshot, so the change list must not be used
+    mocked_write_change_list.assert_not_called()
+    mocked_subprocess_run.assert_called_with(
+        ['rsync', *BASE_RSYNC_OPTIONS_INCREMENTAL,
+         SOURCE_DIR + '/', f'{SERVER}:{DEST_DIR}/{FROZEN_TIMESTAMP}'],
+        check=True)
+
+def test_write_change_list(mocker):
+    """Assert write_change_list() runs the command and writes its output to a tempfile."""
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_named_temporary_file = mocker.patch('rsincr.tempfile.NamedTemporaryFile')
+
+    mocked_subprocess_run.return_value.stdout = b'file01\nfile02\n'
+    change_list_file = rsincr.write_change_list('changelistcmd01')
+
+    mocked_subprocess_run.assert_called_once_with('changelistcmd01', shell=True,
+                                                  capture_output=True, check=True)
+    mocked_change_list_file = mocked_named_temporary_file.return_value.__enter__.return_value
+    mocked_change_list_file.write.assert_called_once_with(b'file01\nfile02\n')
+    assert change_list_file == mocked_change_list_file
+
+def test_backup_skip_unchanged(mocker):
+    """Assert backup() clones the latest snapshot when the source is unchanged, and records
+    the source mtime after a real backup."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_mtime_statefile = mocker.patch('rsincr.mtime_statefile')
+    mocked_get_source_mtime = mocker.patch('rsincr.get_source_mtime')
+    mocked_read_recorded_mtime = mocker.patch('rsincr.read_recorded_mtime')
+    mocked_remote_clone = mocker.patch('rsincr.remote_clone')
+    mocked_record_mtime = mocker.patch('rsincr.record_mtime')
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocker.patch('rsincr.tempfile.NamedTemporaryFile')
+    mocker.patch('rsincr.os.unlink')
+    mocker.patch('rsincr.remote_mkdir')
+    mocker.patch('rsincr.remote_finalize')
+
+    mocked_mtime_statefile.return_value = 'statefile01'
+    mocked_get_source_mtime.return_value = 1000
+    mocked_read_recorded_mtime.return_value = 1000
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL,
+                  SKIP_UNCHANGED_BACKUP_JOB, rsincr.BackupRun(timestamp, 'incremental'))
+    mocked_remote_clone.assert_called_once_with(timestamp, SERVER, SSH_OPTIONS, DEST_DIR)
+    mocked_subprocess_run.assert_not_called()
+    mocked_record_mtime.assert_not_called()
+
+    # A changed source mtime results in a real backup and a newly-recorded mtime
+    mocked_get_source_mtime.return_value = 2000
+    rsincr.backup(SERVER, SSH_OPTIONS, BASE_RSYNC_OPTIONS_INCREMENTAL,
+                  SKIP_UNCHANGED_BACKUP_JOB, rsincr.BackupRun(timestamp, 'incremental'))
+    mocked_subprocess_run.assert_called_once()
+    mocked_record_mtime.assert_called_once_with('statefile01', 2000)
+
+def test_get_source_mtime(tmp_path):
+    """Assert get_source_mtime() returns the newest mtime in the source tree."""
+    source_dir = tmp_path / 'source01'
+    source_subdir = source_dir / 'subdir01'
+    source_subdir.mkdir(parents=True)
+    source_file = source_subdir / 'file01'
+    source_file.write_text('test')
+    os.utime(source_file, ns=(5_000_000_000, 5_000_000_000))
+    os.utime(source_subdir, ns=(3_000_000_000, 3_000_000_000))
+    os.utime(source_dir, ns=(4_000_000_000, 4_000_000_000))
+
+    assert rsincr.get_source_mtime(str(source_dir)) == 5_000_000_000
+
+def test_mtime_statefile(mocker):
+    """Assert mtime_statefile() creates the cache dir and keys the path on job identity."""
+    mocked_expanduser = mocker.patch('rsincr.os.path.expanduser')
+    mocked_makedirs = mocker.patch('rsincr.os.makedirs')
+
+    mocked_expanduser.return_value = 'cachedir01'
+    statefile = rsincr.mtime_statefile(SERVER, BACKUP_JOB)
+
+    mocked_makedirs.assert_called_with('cachedir01', exist_ok=True)
+    assert statefile.startswith('cachedir01/')
+    assert statefile.endswith('.lastmtime')
+    assert rsincr.mtime_statefile(SERVER, BACKUP_JOB) == statefile
+
+    # Jobs differing only by server, source or destination must not share a statefile
+    assert rsincr.mtime_statefile('server02', BACKUP_JOB) != statefile
+    assert rsincr.mtime_statefile(SERVER, dict(BACKUP_JOB, source_dir='source02')) != statefile
+    assert rsincr.mtime_statefile(SERVER, dict(BACKUP_JOB, dest_dir='dest02')) != statefile
+
+    # Destination paths that sanitise to the same filename must not collide either
+    assert rsincr.mtime_statefile(SERVER, dict(BACKUP_JOB, dest_dir='/a/b')) != \
+        rsincr.mtime_statefile(SERVER, dict(BACKUP_JOB, dest_dir='/a_b'))
+
+def test_record_and_read_mtime(tmp_path):
+    """Assert record_mtime() and read_recorded_mtime() round-trip via the statefile."""
+    statefile = str(tmp_path / 'statefile01')
+    assert rsincr.read_recorded_mtime(statefile) is None
+
+    rsincr.record_mtime(statefile, 12345)
+    assert rsincr.read_recorded_mtime(statefile) == 12345
+
+    garbage_statefile = tmp_path / 'statefile02'
+    garbage_statefile.write_text('garbage')
+    assert rsincr.read_recorded_mtime(str(garbage_statefile)) is None
+
+def test_remote_clone_latest(mocker):
+    """Assert remote_clone_latest() hardlink-clones 'latest' in one conditional ssh script."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+
+    mocked_subprocess_run.return_value.stdout = b'cloned\n'
+    assert rsincr.remote_clone_latest(timestamp, SERVER, SSH_OPTIONS, DEST_DIR) is True
+    mocked_subprocess_run.assert_called_once_with(
+        ['ssh', *SSH_OPTIONS, SERVER,
+         f'cd {DEST_DIR} && if [ -h latest ]; then '
+         f'cp -al "$(readlink latest)" {timestamp} && echo cloned; fi'],
+        capture_output=True, check=True)
+
+    # No 'latest' on the destination yet: nothing is cloned
+    mocked_subprocess_run.return_value.stdout = b''
+    assert rsincr.remote_clone_latest(timestamp, SERVER, SSH_OPTIONS, DEST_DIR) is False
+
+def test_remote_clone(mocker):
+    """Assert remote_clone() clones 'latest' and finalizes the new directory."""
+    mocked_remote_clone_latest = mocker.patch('rsincr.remote_clone_latest')
+    mocked_remote_finalize = mocker.patch('rsincr.remote_finalize')
+
+    rsincr.remote_clone(FROZEN_TIMESTAMP, SERVER, SSH_OPTIONS, DEST_DIR)
+
+    mocked_remote_clone_latest.assert_called_once_with(FROZEN_TIMESTAMP, SERVER, SSH_OPTIONS,
+                                                       DEST_DIR)
+    mocked_remote_finalize.assert_called_once_with(FROZEN_TIMESTAMP, SERVER, SSH_OPTIONS,
+                                                   DEST_DIR)
+
+def test_backup_local_destination(tmp_path, mocker):
+    """Assert backup() runs rsync against a local path, without SSH, for local destinations."""
+    timestamp = FROZEN_TIMESTAMP
+    backup_job = {'source_dir': SOURCE_DIR, 'dest_dir': str(tmp_path)}
+    base_rsync_options = rsincr.build_base_rsync_options(TEST_CONFIG, 'incremental', [])
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocker.patch('rsincr.remote_finalize')
+
+    rsincr.backup(None, [], base_rsync_options, backup_job,
+                  rsincr.BackupRun(timestamp, 'incremental'))
+
+    assert '-e' not in base_rsync_options
+    mocked_subprocess_run.assert_called_once_with(
+        ['rsync', *base_rsync_options, SOURCE_DIR + '/', f'{tmp_path}/{timestamp}'],
+        check=True)
+
+def test_remote_mkdir_local(tmp_path):
+    """Assert remote_mkdir() creates a local directory directly for local destinations."""
+    dest_dir = tmp_path / 'dest01' / 'subdir01'
+    rsincr.remote_mkdir(None, [], str(dest_dir))
+    assert dest_dir.is_dir()
+
+def test_remote_finalize_local(tmp_path):
+    """Assert remote_finalize() touches the backup dir and re-points 'latest' locally."""
+    (tmp_path / 'timestamp01').mkdir()
+    (tmp_path / 'latest').symlink_to('timestamp00')
+    rsincr.remote_finalize('timestamp01', None, [], str(tmp_path))
+    assert os.readlink(tmp_path / 'latest') == 'timestamp01'
+
+def test_remote_clone_latest_local(tmp_path, mocker):
+    """Assert remote_clone_latest() hardlink-clones locally, and no-ops without 'latest'."""
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+
+    assert rsincr.remote_clone_latest('timestamp02', None, [], str(tmp_path)) is False
+    mocked_subprocess_run.assert_not_called()
+
+    (tmp_path / 'timestamp01').mkdir()
+    (tmp_path / 'latest').symlink_to('timestamp01')
+    assert rsincr.remote_clone_latest('timestamp02', None, [], str(tmp_path)) is True
+    mocked_subprocess_run.assert_called_once_with(
+        ['cp', '-al', f'{tmp_path}/timestamp01',
+         f'{tmp_path}/timestamp02'],
+        check=True)
+
+def test_purge_local(capsys, mocker):
+    """Assert purge() runs find directly, without SSH, for local destinations."""
+    mocked_subprocess_popen = mocker.patch('rsincr.subprocess.Popen')
+
+    purge_process = mocked_subprocess_popen.return_value.__enter__.return_value
+    purge_process.stdout.read.side_effect = [b'exp_dir01\x00', b'']
+    purge_process.returncode = 0
+    rsincr.purge(None, [], BACKUP_JOB, RETENTION_DAYS)
+    mocked_subprocess_popen.assert_called_once_with(
+        ['find', '-H', DEST_DIR,
+         '-mindepth', '1', '-maxdepth', '1', '-type', 'd',
+         '-mtime', f'+{RETENTION_DAYS}',
+         '-print0', '-exec', 'rm', '-rf', '{}', '+'],
+        stdout=rsincr.subprocess.PIPE)
+    assert capsys.readouterr().out == 'Purged expired backup exp_dir01\n'
+
+def test_build_base_rsync_options():
+    """Assert build_base_rsync_options() returns expected options per backup type."""
+    assert rsincr.build_base_rsync_options(TEST_CONFIG, 'incremental', SSH_OPTIONS) == \
+        BASE_RSYNC_OPTIONS_INCREMENTAL
+    assert rsincr.build_base_rsync_options(TEST_CONFIG, 'full', SSH_OPTIONS) == \
+        BASE_RSYNC_OPTIONS_FULL
+
+    # --checksum forces rsync to read every byte on both sides; it must never leak into
+    # incremental runs, which rely on the cheap size+mtime quick check
+    assert '--checksum' not in rsincr.build_base_rsync_options(
+        TEST_CONFIG, 'incremental', SSH_OPTIONS)
+    assert '--checksum' in rsincr.build_base_rsync_options(TEST_CONFIG, 'full', SSH_OPTIONS)
+
+    # Per-file progress output is only requested when debugging
+    assert '--progress' not in rsincr.build_base_rsync_options(
+        TEST_CONFIG, 'incremental', SSH_OPTIONS, 'INFO')
+    assert '--progress' in rsincr.build_base_rsync_options(
+        TEST_CONFIG, 'incremental', SSH_OPTIONS, 'DEBUG')
+
+    # transfer_mode = "whole" opts out of the delta algorithm and destination temp files
+    config_whole_transfer = copy.deepcopy(TEST_CONFIG)
+    config_whole_transfer['rsync']['transfer_mode'] = 'whole'
+    whole_transfer_options = rsincr.build_base_rsync_options(
+        config_whole_transfer, 'incremental', SSH_OPTIONS)
+    assert '-W' in whole_transfer_options and '--inplace' in whole_transfer_options
+    assert '-W' not in rsincr.build_base_rsync_options(TEST_CONFIG, 'incremental', SSH_OPTIONS)
+
+def test_lazy_import():
+    """Assert lazy_import() returns modules and exits helpfully when one is missing."""
+    assert rsincr.lazy_import('os') is os
+
+    with pytest.raises(SystemExit) as pytest_wrapped_e_missing_module:
+        rsincr.lazy_import('missingmodule01')
+    assert pytest_wrapped_e_missing_module.value.code == \
+        "Required module 'missingmodule01' is not installed"
+
+def test_load_config(mocker):
+    """Assert load_config() parses and validates config, caching on (path, mtime)."""
+    mocked_parse_config_file = mocker.patch('rsincr.parse_config_file')
+    mocked_validate_config = mocker.patch('rsincr.validate_config')
+
+    mocked_parse_config_file.return_value = TEST_CONFIG
+
+    rsincr.load_config.cache_clear()
+    config = rsincr.load_config('config01.toml', 12345)
+    assert config == TEST_CONFIG
+    mocked_validate_config.assert_called_with(TEST_CONFIG)
+
+    # A second call with the same path and mtime should be served from the cache
+    rsincr.load_config('config01.toml', 12345)
+    mocked_parse_config_file.assert_called_once_with('config01.toml')
+
+    # A changed mtime should force a re-parse
+    rsincr.load_config('config01.toml', 12346)
+    assert mocked_parse_config_file.call_count == 2
+
+def test_parse_config_file(tmp_path, mocker):
+    """Assert parse_config_file() parses TOML via tomllib, or via toml when unavailable."""
+    config_file = tmp_path / 'config01.toml'
+    config_file.write_text('[global]\nmax_parallel_jobs = 2\n')
+    assert rsincr.parse_config_file(str(config_file)) == {'global': {'max_parallel_jobs': 2}}
+
+    mocker.patch.dict('sys.modules', {'tomllib': None})
+    mocked_toml_load = mocker.patch('toml.load')
+    mocked_toml_load.return_value = TEST_CONFIG
+    assert rsincr.parse_config_file('config01.toml') == TEST_CONFIG
+    mocked_toml_load.assert_called_once_with('config01.toml')
+
+def test_setup_connection_sharing(mocker):
+    """Assert setup_connection_sharing() starts a master connection and returns ssh options."""
+    mocked_mkdtemp = mocker.patch('rsincr.tempfile.mkdtemp')
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_atexit_register = mocker.patch('rsincr.atexit.register')
+
+    mocked_mkdtemp.return_value = 'control_dir01'
+    ssh_options = rsincr.setup_connection_sharing(SERVER)
+
+    control_path = 'control_dir01/control-%C'
+    assert ssh_options == ['-o', 'ControlMaster=auto', '-o', 'ControlPersist=600',
+                           '-o', f'ControlPath={control_path}']
+    mocked_subprocess_run.assert_called_with(['ssh', *ssh_options, '-Nf', SERVER], check=True)
+    mocked_atexit_register.assert_called_with(
+        rsincr.teardown_connection_sharing, SERVER, ssh_options, 'control_dir01')
+
+def test_teardown_connection_sharing(mocker):
+    """Assert teardown_connection_sharing() stops the master connection and removes control dir."""
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    mocked_rmtree = mocker.patch('rsincr.shutil.rmtree')
+
+    rsincr.teardown_connection_sharing(SERVER, SSH_OPTIONS, 'control_dir01')
 
-def test_parse_args():
+    mocked_subprocess_run.assert_called_with(
+        ['ssh', *SSH_OPTIONS, '-O', 'exit', SERVER], check=False, capture_output=True)
+    mocked_rmtree.assert_called_with('control_dir01', ignore_errors=True)
+
+def test_remote_mkdir(mocker):
+    """Assert remote_mkdir() calls subprocess.run for idempotent directory creation."""
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+
+    rsincr.remote_mkdir(SERVER, SSH_OPTIONS, DEST_DIR)
+    mocked_subprocess_run.assert_called_once_with(
+        ['ssh', *SSH_OPTIONS, SERVER, 'mkdir', '-p', DEST_DIR], check=True)
+
+    # Directory names are quoted for the remote shell
+    mocked_subprocess_run.reset_mock()
+    rsincr.remote_mkdir(SERVER, SSH_OPTIONS, 'dest dir01')
+    mocked_subprocess_run.assert_called_once_with(
+        ['ssh', *SSH_OPTIONS, SERVER, 'mkdir', '-p', "'dest dir01'"], check=True)
+
+def test_purge(capsys, mocker):
+    """Assert purge() runs a single combined find+delete and streams purged backup names."""
+    mocked_subprocess_popen = mocker.patch('rsincr.subprocess.Popen')
+
+    purge_process = mocked_subprocess_popen.return_value.__enter__.return_value
+    purge_process.stdout.read.side_effect = [b'']
+    purge_process.returncode = 0
+    rsincr.purge(SERVER, SSH_OPTIONS, BACKUP_JOB, RETENTION_DAYS)
+    mocked_subprocess_popen.assert_called_once_with(
+        ['ssh', *SSH_OPTIONS, SERVER,
+         'find', '-H', DEST_DIR,
+         '-mindepth', '1', '-maxdepth', '1', '-type', 'd',
+         '-mtime', f'+{RETENTION_DAYS}',
+         '-print0', '-exec', 'rm', '-rf', '{}', '+'],
+        stdout=rsincr.subprocess.PIPE)
+    assert capsys.readouterr().out == ''
+
+    # Directory names are NUL-delimited and may be split across reads
+    purge_process.stdout.read.side_effect = [b'exp_dir01\x00exp', b'_dir02\x00', b'']
+    rsincr.purge(SERVER, SSH_OPTIONS, BACKUP_JOB, RETENTION_DAYS)
+    assert capsys.readouterr().out == (
+        f'Purged expired backup exp_dir01 on server {SERVER}\n'
+        f'Purged expired backup exp_dir02 on server {SERVER}\n')
+
+    purge_process.stdout.read.side_effect = [b'']
+    purge_process.returncode = 1
+    with pytest.raises(rsincr.subprocess.CalledProcessError):
+        rsincr.purge(SERVER, SSH_OPTIONS, BACKUP_JOB, RETENTION_DAYS)
+
+def test_remote_finalize(mocker):
+    """Assert remote_finalize() batches touch and symlink into one subprocess.run call."""
+    timestamp = FROZEN_TIMESTAMP
+    mocked_subprocess_run = mocker.patch('rsincr.subprocess.run')
+    rsincr.remote_finalize(timestamp, SERVER, SSH_OPTIONS, DEST_DIR)
+
+    mocked_subprocess_run.assert_called_once_with(
+        ['ssh', *SSH_OPTIONS, SERVER,
+         f'touch {DEST_DIR}/{timestamp} && '
+         f'ln -sfn {timestamp} {DEST_DIR}/latest'],
+        check=True)
+
+@pytest.mark.parametrize('argv,expected_args', [
+    ('', {'loglevel': None, 'config_file': 'rsincr.toml', 'force_full_backup': False,
+          'jobs': None, 'lockfile': '.rsincr.lock'}),
+    (['-lDEBUG', '-cconfig01.toml', '-fTrue', '-j2', '-klockfile01'],
+     {'loglevel': 'DEBUG', 'config_file': 'config01.toml', 'force_full_backup': True,
+      'jobs': 2, 'lockfile': 'lockfile01'}),
+], ids=['defaults', 'explicit'])
+def test_parse_args(argv, expected_args, mocker):
     """Assert parse_args() returns expected namespace when called with argument combinations."""
-    with mock.patch('builtins.open') as mocked_open:
-
-        type(mocked_open.return_value).name = mock.PropertyMock(return_value='rsincr.toml')
-        empty_args = rsincr.parse_args(argv='')
-        assert empty_args.loglevel is None
-        assert empty_args.config_file.name == 'rsincr.toml'
-        assert empty_args.force_full_backup is False
-
-        type(mocked_open.return_value).name = mock.PropertyMock(return_value='config01.toml')
-        set_args = rsincr.parse_args(argv=['-lDEBUG', '-cconfig01.toml', '-fTrue'])
-        assert set_args.loglevel == 'DEBUG'
-        assert empty_args.config_file.name == 'config01.toml'
-        assert set_args.force_full_backup is True
-
-def test_validate_config():
-    """Assert validate_config() passes with valid config and calls sys.exit with invalid config."""
-    assert rsincr.validate_config(TEST_CONFIG) is None
-
-    config_minimal = copy.deepcopy(TEST_CONFIG)
-    del config_minimal['global']['lockfile']
-    del config_minimal['schedule']['full_backup_week_days']
-    del config_minimal['schedule']['full_backup_month_days']
-    del config_minimal['schedule']['retention_days']
-    del config_minimal['backup_jobs']['job01']['compress']
-    assert rsincr.validate_config(config_minimal) is None
-
-    config_missing_section = copy.deepcopy(TEST_CONFIG)
-    del config_missing_section['global']
-    with pytest.raises(SystemExit) as pytest_wrapped_e_missing_section:
-        rsincr.validate_config(config_missing_section)
-    assert pytest_wrapped_e_missing_section.type == SystemExit
-    assert pytest_wrapped_e_missing_section.value.code == "Missing key: 'global'"
-
-    config_missing_item = copy.deepcopy(TEST_CONFIG)
-    del config_missing_item['destination']['server']
-    with pytest.raises(SystemExit) as pytest_wrapped_e_missing_item:
-        rsincr.validate_config(config_missing_item)
-    assert pytest_wrapped_e_missing_item.type == SystemExit
-    assert pytest_wrapped_e_missing_item.value.code == \
-        "Key 'destination' error:\nMissing key: 'server'"
-
-def test_remove_lockfile():
-    """Assert remove_lockfile calls os.remove on lockfile."""
-    with mock.patch('rsincr.os.remove') as mocked_remove:
-        rsincr.remove_lockfile('lockfile01')
-    mocked_remove.assert_called_with('lockfile01')
+    mocker.patch('rsincr.buffer_logging')
+    args = rsincr.parse_args(argv=argv)
+    for arg_name, arg_value in expected_args.items():
+        assert getattr(args, arg_name) == arg_value
+
+def test_build_parser_cached():
+    """Assert build_parser() constructs the ArgumentParser only once."""
+    assert rsincr.build_parser() is rsincr.build_parser()
+
+def test_buffer_logging():
+    """Assert buffer_logging() wraps root handlers in flush-on-warning MemoryHandlers."""
+    root_logger = logging.getLogger()
+    original_handlers = list(root_logger.handlers)
+    stream_handler = logging.StreamHandler()
+    root_logger.addHandler(stream_handler)
+    try:
+        rsincr.buffer_logging()
+        memory_handlers = [handler for handler in root_logger.handlers
+                           if isinstance(handler, logging.handlers.MemoryHandler)]
+        assert any(handler.target is stream_handler for handler in memory_handlers)
+        assert all(handler.flushLevel == logging.WARNING for handler in memory_handlers)
+    finally:
+        root_logger.handlers = original_handlers
+
+def config_without(*key_paths, base=None):
+    """Return a deep copy of base (default TEST_CONFIG) with the given dotted key paths
+    removed. Used to build validation test parameters once at import."""
+    config = copy.deepcopy(base if base is not None else TEST_CONFIG)
+    for key_path in key_paths:
+        section = config
+        *parents, leaf = key_path.split('.')
+        for parent in parents:
+            section = section[parent]
+        del section[leaf]
+    return config
+
+def config_with(key_path, value, base=None):
+    """Return a deep copy of base (default TEST_CONFIG) with the dotted key path set to
+    value. Used to build validation test parameters once at import."""
+    config = copy.deepcopy(base if base is not None else TEST_CONFIG)
+    section = config
+    *parents, leaf = key_path.split('.')
+    for parent in parents:
+        section = section[parent]
+    section[leaf] = value
+    return config
+
+LOCAL_CONFIG = config_with('destination.local', True,
+                           base=config_without('destination.server'))
+
+@pytest.mark.parametrize('config', [
+    TEST_CONFIG,
+    config_without('global.max_parallel_jobs',
+                   'schedule.full_backup_week_days',
+                   'schedule.full_backup_month_days',
+                   'schedule.retention_days',
+                   'backup_jobs.job01.compress'),
+    config_with('backup_jobs.job01.source_dir', ['source01', 'source02']),
+    LOCAL_CONFIG,
+], ids=['full', 'minimal', 'multiple-sources', 'local'])
+def test_validate_config(config):
+    """Assert validate_config() passes with valid config variants."""
+    assert rsincr.validate_config(config) is None
+
+@pytest.mark.parametrize('config,expected_code', [
+    (config_without('global'), "Missing key: 'global'"),
+    (config_without('destination.server'),
+     "Key 'destination' error:\nMissing key: 'server'"),
+    (config_with('unknown', {}), "Wrong key: 'unknown'"),
+    (config_with('global', 'notasection'), "Key 'global' error:\nNot a section"),
+    (config_with('global.unknown', 1), "Key 'global' error:\nWrong key: 'unknown'"),
+    (config_with('schedule.retention_days', '30'),
+     "Key 'schedule' error:\nKey 'retention_days' error:\n"
+     "'30' should be instance of 'int'"),
+    (config_with('backup_jobs.job01.exclude', [1]),
+     "Key 'backup_jobs.job01' error:\nKey 'exclude' error:\n"
+     "All elements of [1] should be instance of 'str'"),
+    (config_with('backup_jobs', {}),
+     "Key 'backup_jobs' error:\nAt least one backup job must be defined"),
+    (config_with('rsync.transfer_mode', 'partial'),
+     "Key 'rsync' error:\nKey 'transfer_mode' error:\nMust be 'delta' or 'whole'"),
+    (config_without('backup_jobs.job01.source_dir'),
+     "Key 'backup_jobs.job01' error:\nMissing key: 'source_dir'"),
+    (config_with('destination.local', True),
+     "Key 'destination' error:\nOnly one of 'server' and 'local' may be set"),
+], ids=['missing-section', 'missing-item', 'unknown-section', 'not-a-section',
+        'unknown-item', 'bad-type', 'bad-element', 'no-jobs', 'bad-transfer-mode',
+        'job-missing-item', 'server-and-local'])
+def test_validate_config_invalid(config, expected_code):
+    """Assert validate_config() calls sys.exit with a descriptive message for invalid config."""
+    with pytest.raises(SystemExit) as pytest_wrapped_e:
+        rsincr.validate_config(config)
+    assert pytest_wrapped_e.type == SystemExit
+    assert pytest_wrapped_e.value.code == expected_code